@@ -33,6 +33,12 @@ from eggo.util import sleep_progressive
 from eggo.config import get_ec2_key_pair
 
 
+# boto connections are cached per region so that repeated calls within a
+# session reuse the same underlying HTTPS connection pool
+_cf_connections = {}
+_ec2_connections = {}
+
+
 # CLOUDFORMATION UTIL
 
 
@@ -55,7 +61,9 @@ def wait_for_stack_status(cf_conn, stack_name, stack_status):
 
 
 def create_cf_connection(region):
-    return boto.cloudformation.connect_to_region(region)
+    if region not in _cf_connections:
+        _cf_connections[region] = boto.cloudformation.connect_to_region(region)
+    return _cf_connections[region]
 
 
 def create_cf_stack(cf_conn, stack_name, cf_template_path, availability_zone):
@@ -78,19 +86,15 @@ def create_cf_stack(cf_conn, stack_name, cf_template_path, availability_zone):
     wait_for_stack_status(cf_conn, stack_name, 'CREATE_COMPLETE')
 
 
-def get_stack_resource_id(cf_conn, stack_name, logical_resource_id):
-    for resource in cf_conn.describe_stack_resources(stack_name):
-        if resource.logical_resource_id == logical_resource_id:
-            return resource.physical_resource_id
-    return None
-
-
-def get_subnet_id(cf_conn, stack_name):
-    return get_stack_resource_id(cf_conn, stack_name, 'DMZSubnet')
+def get_stack_resource_ids(cf_conn, stack_name):
+    # logical -> physical resource ids from one DescribeStackResources call
+    return dict((resource.logical_resource_id, resource.physical_resource_id)
+                for resource in cf_conn.describe_stack_resources(stack_name))
 
 
-def get_security_group_id(cf_conn, stack_name):
-    return get_stack_resource_id(cf_conn, stack_name, 'ClusterSG')
+def get_subnet_and_security_group_ids(cf_conn, stack_name):
+    resource_ids = get_stack_resource_ids(cf_conn, stack_name)
+    return (resource_ids.get('DMZSubnet'), resource_ids.get('ClusterSG'))
 
 
 def delete_stack(cf_conn, stack_name):
@@ -103,7 +107,9 @@ def delete_stack(cf_conn, stack_name):
 
 
 def create_ec2_connection(region):
-    return boto.ec2.connect_to_region(region)
+    if region not in _ec2_connections:
+        _ec2_connections[region] = boto.ec2.connect_to_region(region)
+    return _ec2_connections[region]
 
 
 def get_tagged_instances(ec2_conn, tags):
@@ -43,3 +43,14 @@ def get_ec2_key_pair():
 
 def get_ec2_private_key_file():
     return _get_env_var('EC2_PRIVATE_KEY_FILE')
+
+
+def get_parallel_pool_size():
+    # max number of hosts Fabric operates on concurrently in @parallel tasks
+    try:
+        pool_size = int(os.environ.get('EGGO_PARALLEL_POOL_SIZE', 16))
+    except ValueError:
+        raise ConfigError('EGGO_PARALLEL_POOL_SIZE must be an integer')
+    if pool_size < 1:
+        raise ConfigError('EGGO_PARALLEL_POOL_SIZE must be at least 1')
+    return pool_size
@@ -30,18 +30,19 @@ from boto.ec2.networkinterface import (
     NetworkInterfaceCollection, NetworkInterfaceSpecification)
 from fabric.api import (
     sudo, run, execute, put, open_shell, env, parallel, cd)
-from fabric.contrib.files import append, exists
+from fabric.contrib.files import append
 from cm_api.api_client import ApiResource
 
 from eggo.error import EggoError
 from eggo.config import (
     get_aws_access_key_id, get_aws_secret_access_key, get_ec2_key_pair,
-    get_ec2_private_key_file)
+    get_ec2_private_key_file, get_parallel_pool_size)
 from eggo.aws import (
-    create_cf_connection, create_cf_stack, get_subnet_id, delete_stack,
-    get_security_group_id, create_ec2_connection, get_tagged_instances,
+    create_cf_connection, create_cf_stack, get_subnet_and_security_group_ids,
+    delete_stack, create_ec2_connection, get_tagged_instances,
     wait_for_instance_state)
-from eggo.util import non_blocking_tunnel, tunnel_ctx
+from eggo.util import (
+    non_blocking_tunnel, non_blocking_multi_tunnel, tunnel_ctx)
 from eggo.operations import generate_eggo_env_vars
 
 
@@ -58,8 +59,7 @@ def cm_tunnel_ctx(manager_instance):
 
 
 def install_private_key():
-    put(get_ec2_private_key_file(), 'id.pem')
-    run('chmod 600 id.pem')
+    put(get_ec2_private_key_file(), 'id.pem', mode=0600)
 
 
 def install_director_client():
@@ -79,23 +79,27 @@ def create_launcher_instance(ec2_conn, cf_conn, stack_name, launcher_ami,
         return launcher_instances[0]
 
     print "Creating launcher instance."
+    (subnet_id, security_group_id) = get_subnet_and_security_group_ids(
+        cf_conn, stack_name)
+    key_pair = get_ec2_key_pair()
     # see http://stackoverflow.com/questions/19029588/how-to-auto-assign-public-ip-to-ec2-instance-with-boto
     interface = NetworkInterfaceSpecification(
-        subnet_id=get_subnet_id(cf_conn, stack_name),
-        groups=[get_security_group_id(cf_conn, stack_name)],
+        subnet_id=subnet_id,
+        groups=[security_group_id],
         associate_public_ip_address=True)
     interfaces = NetworkInterfaceCollection(interface)
     reservation = ec2_conn.run_instances(
         launcher_ami,
-        key_name=get_ec2_key_pair(),
+        key_name=key_pair,
         instance_type=launcher_instance_type,
         network_interfaces=interfaces)
     launcher_instance = reservation.instances[0]
 
-    launcher_instance.add_tag('owner', getuser())
-    launcher_instance.add_tag('ec2_key_pair', get_ec2_key_pair())
-    launcher_instance.add_tag('eggo_stack_name', stack_name)
-    launcher_instance.add_tag('eggo_node_type', 'launcher')
+    ec2_conn.create_tags([launcher_instance.id],
+                         {'owner': getuser(),
+                          'ec2_key_pair': key_pair,
+                          'eggo_stack_name': stack_name,
+                          'eggo_node_type': 'launcher'})
     wait_for_instance_state(ec2_conn, launcher_instance)
     execute(install_director_client, hosts=[launcher_instance.ip_address])
     execute(install_private_key, hosts=[launcher_instance.ip_address])
@@ -106,20 +110,24 @@ def run_director_bootstrap(director_conf_path, region, cluster_ami,
                            num_workers, stack_name, worker_instance_type):
     # replace variables in conf template and copy to launcher
     cf_conn = create_cf_connection(region)
+    (subnet_id, security_group_id) = get_subnet_and_security_group_ids(
+        cf_conn, stack_name)
     params = {'accessKeyId': get_aws_access_key_id(),
               'secretAccessKey': get_aws_secret_access_key(),
               'region': region,
               'stack_name': stack_name,
               'owner': getuser(),
               'keyName': get_ec2_key_pair(),
-              'subnetId': get_subnet_id(cf_conn, stack_name),
-              'securityGroupsIds': get_security_group_id(cf_conn, stack_name),
+              'subnetId': subnet_id,
+              'securityGroupsIds': security_group_id,
               'image': cluster_ami,
               'num_workers': num_workers,
               'worker_instance_type': worker_instance_type}
     with open(director_conf_path, 'r') as template_file:
         interpolated_body = template_file.read() % params
         director_conf = StringIO(interpolated_body)
+    # uploaded with put rather than through a shell command, as the body
+    # includes AWS credentials
     put(director_conf, 'director.conf')
     # bootstrap the Hadoop cluster
     run('cloudera-director bootstrap director.conf')
@@ -129,6 +137,7 @@ def provision(region, availability_zone, stack_name, cf_template_path,
               launcher_ami, launcher_instance_type, worker_instance_type,
               director_conf_path, cluster_ami, num_workers):
     start_time = datetime.now()
+    invalidate_instance_cache()
 
     # create cloudformation stack (VPC etc)
     cf_conn = create_cf_connection(region)
@@ -152,24 +161,43 @@ def provision(region, availability_zone, stack_name, cf_template_path,
         t=(end_time - start_time).seconds / 60)
 
 
+# tagged instance lookups are cached for the lifetime of the process, as the
+# cluster topology does not change while a command is running.  The cache maps
+# (region, stack_name) -> {node_type: [instances]}, filled by a single EC2
+# query per stack
+_instance_cache = {}
+
+
+def invalidate_instance_cache():
+    _instance_cache.clear()
+
+
+def _get_node_instances(ec2_conn, stack_name, node_type):
+    key = (ec2_conn.region.name, stack_name)
+    if key not in _instance_cache:
+        nodes = {}
+        for instance in get_tagged_instances(
+                ec2_conn, {'eggo_stack_name': stack_name}):
+            nodes.setdefault(
+                instance.tags.get('eggo_node_type'), []).append(instance)
+        _instance_cache[key] = nodes
+    return _instance_cache[key].get(node_type, [])
+
+
 def get_launcher_instance(ec2_conn, stack_name):
-    return get_tagged_instances(ec2_conn, {'eggo_stack_name': stack_name,
-                                           'eggo_node_type': 'launcher'})[0]
+    return _get_node_instances(ec2_conn, stack_name, 'launcher')[0]
 
 
 def get_manager_instance(ec2_conn, stack_name):
-    return get_tagged_instances(ec2_conn, {'eggo_stack_name': stack_name,
-                                           'eggo_node_type': 'manager'})[0]
+    return _get_node_instances(ec2_conn, stack_name, 'manager')[0]
 
 
 def get_master_instance(ec2_conn, stack_name):
-    return get_tagged_instances(ec2_conn, {'eggo_stack_name': stack_name,
-                                           'eggo_node_type': 'master'})[0]
+    return _get_node_instances(ec2_conn, stack_name, 'master')[0]
 
 
 def get_worker_instances(ec2_conn, stack_name):
-    return get_tagged_instances(ec2_conn, {'eggo_stack_name': stack_name,
-                                           'eggo_node_type': 'worker'})
+    return _get_node_instances(ec2_conn, stack_name, 'worker')
 
 
 def describe(region, stack_name):
@@ -200,6 +228,7 @@ def web_proxy(region, stack_name):
     manager_instance = get_manager_instance(ec2_conn, stack_name)
     master_instance = get_master_instance(ec2_conn, stack_name)
     worker_instances = get_worker_instances(ec2_conn, stack_name)
+    private_key = get_ec2_private_key_file()
 
     tunnels = []
     ts = '{0:<22}{1:<17}{2:<17}{3:<7}localhost:{4}'
@@ -208,26 +237,20 @@ def web_proxy(region, stack_name):
     # CM
     tunnels.append(non_blocking_tunnel(manager_instance.ip_address,
                                        manager_instance.private_ip_address,
-                                       7180, 7180, 'ec2-user',
-                                       get_ec2_private_key_file()))
+                                       7180, 7180, 'ec2-user', private_key))
     print(ts.format(
         'CM WebUI', manager_instance.ip_address,
         manager_instance.private_ip_address, 7180, 7180))
 
-    # YARN RM
-    tunnels.append(non_blocking_tunnel(master_instance.ip_address,
-                                       master_instance.private_ip_address,
-                                       8088, 8088, 'ec2-user',
-                                       get_ec2_private_key_file()))
+    # YARN RM and JobHistory share a single ssh connection to the master
+    tunnels.append(non_blocking_multi_tunnel(
+        master_instance.ip_address,
+        [(master_instance.private_ip_address, 8088, 8088),
+         (master_instance.private_ip_address, 19888, 19888)],
+        'ec2-user', private_key))
     print(ts.format(
         'YARN RM', master_instance.ip_address,
         master_instance.private_ip_address, 8088, 8088))
-
-    # YARN JobHistory
-    tunnels.append(non_blocking_tunnel(master_instance.ip_address,
-                                       master_instance.private_ip_address,
-                                       19888, 19888, 'ec2-user',
-                                       get_ec2_private_key_file()))
     print(ts.format(
         'YARN JobHistory', master_instance.ip_address,
         master_instance.private_ip_address, 19888, 19888))
@@ -252,6 +275,8 @@ def terminate_launcher_instance(ec2_conn, stack_name):
 
 
 def teardown(region, stack_name):
+    invalidate_instance_cache()
+
     # terminate Hadoop cluster (prompts for confirmation)
     ec2_conn = create_ec2_connection(region)
     execute(run_director_terminate,
@@ -293,7 +318,7 @@ def install_java_8(region, stack_name):
         cluster.stop().wait()
 
     # Stop all Cloudera Manager Agents
-    @parallel
+    @parallel(pool_size=get_parallel_pool_size())
     def stop_cm_agents():
         sudo('service cloudera-scm-agent stop')
     execute(stop_cm_agents, hosts=cluster_hosts)
@@ -304,16 +329,15 @@ def install_java_8(region, stack_name):
     execute(stop_cm_server, hosts=[manager_instance.ip_address])
 
     # Cleanup other Java versions and install JDK 1.8
-    @parallel
+    @parallel(pool_size=get_parallel_pool_size())
     def swap_jdks():
-        sudo('rpm -qa | grep jdk | xargs rpm -e')
-        sudo('rm -rf /usr/java/jdk1.6*')
-        sudo('rm -rf /usr/java/jdk1.7*')
         run('wget -O jdk-8-linux-x64.rpm --no-cookies --no-check-certificate '
             '--header "Cookie: oraclelicense=accept-securebackup-cookie" '
             'http://download.oracle.com/otn-pub/java/jdk/8u51-b16/'
             'jdk-8u51-linux-x64.rpm')
-        sudo('yum install -y jdk-8-linux-x64.rpm')
+        sudo('rpm -qa | grep jdk | xargs rpm -e && '
+             'rm -rf /usr/java/jdk1.6* /usr/java/jdk1.7* && '
+             'yum install -y jdk-8-linux-x64.rpm')
         append('/home/ec2-user/.bash_profile',
                'export JAVA_HOME=`find /usr/java -name "jdk1.8*"`')
     execute(swap_jdks, hosts=cluster_hosts)
@@ -324,7 +348,7 @@ def install_java_8(region, stack_name):
     execute(start_cm_server, hosts=[manager_instance.ip_address])
 
     # Start all Cloudera Manager Agents
-    @parallel
+    @parallel(pool_size=get_parallel_pool_size())
     def start_cm_agents():
         sudo('service cloudera-scm-agent start')
     execute(start_cm_agents, hosts=cluster_hosts)
@@ -345,86 +369,116 @@ def install_java_8(region, stack_name):
 
 
 def create_hdfs_home():
-    sudo('hadoop fs -mkdir /user/ec2-user', user='hdfs')
-    sudo('hadoop fs -chown ec2-user:supergroup /user/ec2-user', user='hdfs')
-    sudo('hadoop fs -chmod 777 /user/ec2-user', user='hdfs')
+    sudo('hadoop fs -mkdir /user/ec2-user && '
+         'hadoop fs -chown ec2-user:supergroup /user/ec2-user && '
+         'hadoop fs -chmod 777 /user/ec2-user', user='hdfs')
 
 
 def install_dev_tools():
-    sudo("yum groupinstall -y 'Development Tools'")
-    sudo('yum install -y cmake xz-devel ncurses ncurses-devel')
-    sudo('yum install -y zlib zlib-devel snappy snappy-devel')
-    sudo('yum install -y python-devel')
-    sudo('curl https://bootstrap.pypa.io/get-pip.py | python')
-    sudo('pip install -U pip setuptools')
+    # single remote invocation to avoid an ssh round-trip per step
+    sudo("yum groupinstall -y 'Development Tools' && "
+         'yum install -y cmake xz-devel ncurses ncurses-devel zlib '
+         'zlib-devel snappy snappy-devel python-devel git && '
+         'curl https://bootstrap.pypa.io/get-pip.py | python && '
+         'pip install -U pip setuptools')
+
+
+# default tool versions, shared by prefetch_tools and the install_* functions
+PARQUET_TOOLS_VERSION = '1.8.1'
+MAVEN_VERSION = '3.3.3'
+GRADLE_VERSION = '2.6'
 
 
-def install_parquet_tools(version='1.8.1'):
-    run('curl -L -O http://search.maven.org/remotecontent?filepath=org/apache/'
-        'parquet/parquet-tools/{0}/parquet-tools-{0}.jar'.format(version))
+def _parquet_tools_download(version):
+    return ('http://search.maven.org/remotecontent?filepath=org/apache/'
+            'parquet/parquet-tools/{0}/parquet-tools-{0}.jar'.format(version),
+            'parquet-tools-{0}.jar'.format(version))
 
 
-def install_git():
-    sudo('yum install -y git')
+def _maven_download(version):
+    return ('http://apache.mesi.com.ar/maven/maven-3/{0}/binaries/'
+            'apache-maven-{0}-bin.tar.gz'.format(version),
+            'apache-maven-{0}-bin.tar.gz'.format(version))
 
 
-def install_maven(version='3.3.3'):
-    url = ('http://apache.mesi.com.ar/maven/maven-3/{0}/binaries/'
-           'apache-maven-{0}-bin.tar.gz'.format(version))
-    run('wget {0}'.format(url))
-    run('tar -xzf apache-maven-{0}-bin.tar.gz'.format(version))
+def _gradle_download(version):
+    return ('https://services.gradle.org/distributions/'
+            'gradle-{0}-bin.zip'.format(version),
+            'gradle-{0}-bin.zip'.format(version))
+
+
+def _download_cmd(url, filename):
+    # skips files that are already present; downloads go to a temp name first
+    # so that an interrupted download is never mistaken for a complete one
+    return ("test -f {f} || (wget -q -O {f}.part '{url}' && mv {f}.part {f})"
+            .format(url=url, f=filename))
+
+
+def prefetch_tools(parquet_tools_version=PARQUET_TOOLS_VERSION,
+                   maven_version=MAVEN_VERSION, gradle_version=GRADLE_VERSION):
+    # run the downloads concurrently so they overlap each other; any that fail
+    # are simply retried by the corresponding install_* function
+    downloads = [_parquet_tools_download(parquet_tools_version),
+                 _maven_download(maven_version),
+                 _gradle_download(gradle_version)]
+    run(' & '.join('({0})'.format(_download_cmd(*d)) for d in downloads) +
+        ' & wait')
+
+
+def install_parquet_tools(version=PARQUET_TOOLS_VERSION):
+    run(_download_cmd(*_parquet_tools_download(version)))
+
+
+def install_maven(version=MAVEN_VERSION):
+    (url, filename) = _maven_download(version)
+    run('{0} && tar -xzf {1}'.format(_download_cmd(url, filename), filename))
     append('/home/ec2-user/.bash_profile',
            'export PATH=/home/ec2-user/apache-maven-{0}/bin:$PATH'.format(
                version))
 
 
-def install_gradle(version='2.6'):
-    url = ('https://services.gradle.org/distributions/'
-           'gradle-{0}-bin.zip'.format(version))
-    run('wget {0}'.format(url))
-    run('unzip gradle-{0}-bin.zip'.format(version))
+def install_gradle(version=GRADLE_VERSION):
+    (url, filename) = _gradle_download(version)
+    run('{0} && unzip {1}'.format(_download_cmd(url, filename), filename))
     append('/home/ec2-user/.bash_profile',
            'export PATH=/home/ec2-user/gradle-{0}/bin:$PATH'.format(version))
 
 
+def _github_checkout_cmd(fork, repo, branch):
+    # idempotent clone/update and checkout, issued as a single remote command;
+    # an existing checkout has its remote re-pointed at the requested fork and
+    # is fetched, while a fresh clone is already up to date
+    return ('(if [ -d {repo} ]; then (cd {repo} && '
+            'git remote set-url origin {url} && git fetch --quiet); '
+            'else git clone {url}; fi) '
+            '&& cd {repo} && git checkout origin/{branch}'
+            .format(repo=repo, branch=branch,
+                    url='https://github.com/{0}/{1}.git'.format(fork, repo)))
+
+
 def install_adam(fork='bigdatagenomics', branch='master'):
-    run('git clone https://github.com/{0}/adam.git'.format(fork))
-    with cd('adam'):
-        if branch != 'master':
-            run('git checkout origin/{0}'.format(branch))
-        run('mvn clean package -DskipTests')
+    run(_github_checkout_cmd(fork, 'adam', branch) +
+        ' && mvn clean package -DskipTests')
 
 
 def install_opencb_ga4gh(fork='opencb', branch='master'):
-    run('git clone https://github.com/{0}/ga4gh.git'.format(fork))
-    with cd('ga4gh'):
-        if branch != 'master':
-            run('git checkout origin/{0}'.format(branch))
-        run('mvn clean install -DskipTests')
+    run(_github_checkout_cmd(fork, 'ga4gh', branch) +
+        ' && mvn clean install -DskipTests')
 
 
 def install_opencb_java_common(fork='opencb', branch='develop'):
-    run('git clone https://github.com/{0}/java-common-libs.git'.format(fork))
-    with cd('java-common-libs'):
-        if branch != 'develop':
-            run('git checkout origin/{0}'.format(branch))
-        run('mvn clean install -DskipTests')
+    run(_github_checkout_cmd(fork, 'java-common-libs', branch) +
+        ' && mvn clean install -DskipTests')
 
 
 def install_opencb_biodata(fork='opencb', branch='develop'):
-    run('git clone https://github.com/{0}/biodata.git'.format(fork))
-    with cd('biodata'):
-        if branch != 'develop':
-            run('git checkout origin/{0}'.format(branch))
-        run('mvn clean install -DskipTests')
+    run(_github_checkout_cmd(fork, 'biodata', branch) +
+        ' && mvn clean install -DskipTests')
 
 
 def install_opencb_hpg_bigdata(fork='opencb', branch='develop'):
-    run('git clone https://github.com/{0}/hpg-bigdata.git'.format(fork))
-    with cd('hpg-bigdata'):
-        if branch != 'develop':
-            run('git checkout origin/{0}'.format(branch))
-        run('./build.sh')
+    run(_github_checkout_cmd(fork, 'hpg-bigdata', branch) +
+        ' && ./build.sh')
 
 
 def install_opencb(hosts):
@@ -435,28 +489,20 @@ def install_opencb(hosts):
 
 
 def install_quince(fork='cloudera', branch='master'):
-    run('git clone https://github.com/{0}/quince.git'.format(fork))
-    with cd('quince'):
-        if branch != 'master':
-            run('git checkout origin/{0}'.format(branch))
-        run('mvn clean package -DskipTests')
+    run(_github_checkout_cmd(fork, 'quince', branch) +
+        ' && mvn clean package -DskipTests')
 
 
 def install_gatk(fork='broadinstitute', branch='master'):
-    run('git clone https://github.com/{0}/gatk.git'.format(fork))
-    with cd('gatk'):
-        if branch != 'master':
-            run('git checkout origin/{0}'.format(branch))
-        run('gradle sparkJar')
+    run(_github_checkout_cmd(fork, 'gatk', branch) +
+        ' && gradle sparkJar')
 
 
 def install_eggo(fork='bigdatagenomics', branch='master', reinstall=False):
-    if reinstall and exists('/home/ec2-user/eggo'):
+    if reinstall:
         sudo('rm -rf /home/ec2-user/eggo')
-    run('git clone https://github.com/{0}/eggo.git'.format(fork))
+    run(_github_checkout_cmd(fork, 'eggo', branch))
     with cd('eggo'):
-        if branch != 'master':
-            run('git checkout origin/{0}'.format(branch))
         sudo('python setup.py install')
 
 
@@ -521,8 +567,8 @@ def config_cluster(region, stack_name, adam, adam_fork, adam_branch, opencb,
     install_java_8(region, stack_name)
 
     # install software tools
+    execute(prefetch_tools, hosts=[master_host])
     execute(install_dev_tools, hosts=[master_host])
-    execute(install_git, hosts=[master_host])
     execute(install_maven, hosts=[master_host])
     execute(install_gradle, hosts=[master_host])
     execute(install_parquet_tools, hosts=[master_host])
@@ -26,13 +26,20 @@ from os.path import join as pjoin
 from hashlib import md5
 
 
-def sanitize(dirty):
+_SANITIZE_RE = re.compile(r'[/\\;:?=]')
+
+
+def sanitize(dirty, digest=None):
     # for sanitizing URIs/filenames
     # inspired by datacache
-    clean = re.sub(r'/|\\|;|:|\?|=', '_', dirty)
+    # digest may be passed in if the caller already has the md5 hexdigest
+    clean = _SANITIZE_RE.sub('_', dirty)
     if len(clean) > 150:
-        prefix = md5(dirty).hexdigest()
-        clean = prefix + clean[-114:]
+        if digest is None:
+            if isinstance(dirty, unicode):
+                dirty = dirty.encode('utf-8')
+            digest = md5(dirty).hexdigest()
+        clean = digest + clean[-114:]
     return clean
 
 
@@ -40,7 +47,7 @@ def uri_to_sanitized_filename(source_uri, decompress=False):
     # inspired by datacache
     digest = md5(source_uri.encode('utf-8')).hexdigest()
     filename = '{digest}.{sanitized_uri}'.format(
-        digest=digest, sanitized_uri=sanitize(source_uri))
+        digest=digest, sanitized_uri=sanitize(source_uri, digest))
     if decompress:
         (base, ext) = os.path.splitext(filename)
         if ext == '.gz':
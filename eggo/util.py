@@ -22,29 +22,35 @@
 import os
 import re
 import time
-import random
-import string
 import os.path as osp
 from os.path import join as pjoin
 from uuid import uuid4
 from getpass import getuser
 from shutil import rmtree
 from hashlib import md5
+from binascii import hexlify
 from tempfile import mkdtemp
 from datetime import datetime
 from subprocess import check_call, Popen, CalledProcessError
 from contextlib import contextmanager
 
+from eggo.error import EggoError
+
+try:
+    from snakebite.client import AutoConfigClient
+    from snakebite.errors import InvalidInputException
+except ImportError:
+    AutoConfigClient = None
+
 
 def uuid():
     return uuid4().hex
 
 
 def random_id(prefix='tmp_eggo', n=4):
-    dt_string = datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
-    rand_string = ''.join(random.sample(string.ascii_uppercase, n))
-    return '{pre}_{dt}_{rand}'.format(pre=prefix.rstrip('_', 1), dt=dt_string,
-                                      rand=rand_string)
+    return '{pre}_{ts}_{rand}'.format(pre=prefix.rstrip('_'),
+                                      ts=int(time.time()),
+                                      rand=hexlify(os.urandom(n)))
 
 
 def sleep_progressive(start_time):
@@ -68,13 +74,20 @@ def resource_dir():
 # ==============
 
 
-def sanitize(dirty):
+_SANITIZE_RE = re.compile(r'[/\\;:?=]')
+
+
+def sanitize(dirty, digest=None):
     # for sanitizing URIs/filenames
     # inspired by datacache
-    clean = re.sub(r'/|\\|;|:|\?|=', '_', dirty)
+    # digest may be passed in if the caller already has the md5 hexdigest
+    clean = _SANITIZE_RE.sub('_', dirty)
     if len(clean) > 150:
-        prefix = md5(dirty).hexdigest()
-        clean = prefix + clean[-114:]
+        if digest is None:
+            if isinstance(dirty, unicode):
+                dirty = dirty.encode('utf-8')
+            digest = md5(dirty).hexdigest()
+        clean = digest + clean[-114:]
     return clean
 
 
@@ -82,7 +95,7 @@ def uri_to_sanitized_filename(source_uri, decompress=False):
     # inspired by datacache
     digest = md5(source_uri.encode('utf-8')).hexdigest()
     filename = '{digest}.{sanitized_uri}'.format(
-        digest=digest, sanitized_uri=sanitize(source_uri))
+        digest=digest, sanitized_uri=sanitize(source_uri, digest))
     if decompress:
         (base, ext) = os.path.splitext(filename)
         if ext == '.gz':
@@ -99,17 +112,52 @@ def make_local_tmp(prefix='tmp_eggo_', dir_=None):
         rmtree(tmpdir)
 
 
+_hdfs_client = None
+
+
+def get_hdfs_client():
+    # snakebite speaks HDFS RPC directly, avoiding a JVM startup per
+    # `hadoop fs` call; returns None if it is not installed or cannot find
+    # the namenode
+    global _hdfs_client
+    if _hdfs_client is None and AutoConfigClient is not None:
+        try:
+            _hdfs_client = AutoConfigClient()
+        except InvalidInputException:
+            pass
+    return _hdfs_client
+
+
+def _check_hdfs_results(results):
+    # snakebite reports some failures as result dicts rather than raising, and
+    # its calls return lazy generators, so this also forces them to run
+    for r in results:
+        if not r.get('result'):
+            raise EggoError('HDFS operation failed on {0}: {1}'.format(
+                r.get('path'), r.get('error')))
+
+
 @contextmanager
 def make_hdfs_tmp(prefix='tmp_eggo', dir_='/tmp', permissions='755'):
     tmpdir = pjoin(dir_, '_'.join([prefix, uuid()]))
-    check_call('hadoop fs -mkdir {0}'.format(tmpdir).split())
-    if permissions != '755':
-        check_call(
-            'hadoop fs -chmod -R {0} {1}'.format(permissions, tmpdir).split())
+    client = get_hdfs_client()
+    if client is not None:
+        _check_hdfs_results(client.mkdir([tmpdir]))
+        if permissions != '755':
+            _check_hdfs_results(
+                client.chmod([tmpdir], int(permissions, 8), recurse=True))
+    else:
+        check_call('hadoop fs -mkdir {0}'.format(tmpdir).split())
+        if permissions != '755':
+            check_call('hadoop fs -chmod -R {0} {1}'.format(
+                permissions, tmpdir).split())
     try:
         yield tmpdir
     finally:
-        check_call('hadoop fs -rm -r {0}'.format(tmpdir).split())
+        if client is not None:
+            _check_hdfs_results(client.delete([tmpdir], recurse=True))
+        else:
+            check_call('hadoop fs -rm -r {0}'.format(tmpdir).split())
 
 
 # ====================
@@ -121,15 +169,27 @@ def non_blocking_tunnel(tunnel_host, remote_host, remote_port, local_port=None,
                         user=None, private_key=None):
     if local_port is None:
         local_port = remote_port
+    return non_blocking_multi_tunnel(
+        tunnel_host, [(remote_host, remote_port, local_port)], user,
+        private_key)
+
+
+def non_blocking_multi_tunnel(tunnel_host, forwards, user=None,
+                              private_key=None):
+    # forwards is a list of (remote_host, remote_port, local_port) tuples; all
+    # of them are multiplexed over a single ssh connection to tunnel_host
     if user is None:
         user = getuser()
     private_key = '-i {0}'.format(private_key) if private_key else ''
+    forward_opts = ' '.join(
+        '-L {local}:{remote_host}:{remote}'.format(
+            local=local_port, remote_host=remote_host, remote=remote_port)
+        for (remote_host, remote_port, local_port) in forwards)
     p = Popen('ssh -nNT {private_key} -o UserKnownHostsFile=/dev/null '
-              '-o StrictHostKeyChecking=no -L {local}:{remote_host}:{remote} '
+              '-o StrictHostKeyChecking=no {forwards} '
               '{user}@{tunnel_host}'.format(
                   private_key=private_key, tunnel_host=tunnel_host,
-                  remote_host=remote_host, user=user, local=local_port,
-                  remote=remote_port),
+                  user=user, forwards=forward_opts),
               shell=True)
     return p
 
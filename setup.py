@@ -34,6 +34,7 @@ setup(
     package_data={'eggo.resources': ['*.template', '*.conf']},
     include_package_data=True,
     install_requires=['fabric', 'boto', 'click', 'cm_api'],
+    extras_require={'hdfs': ['snakebite']},
     entry_points={'console_scripts': ['eggo-cluster = eggo.cli.cluster:main',
                                       'eggo-data = eggo.cli.datasets:main']},
     keywords=('bdg adam spark eggo genomics omics public data'),